@@ -1,5 +1,24 @@
 import requests
+import builtins
+import codecs
 import json
+import math
+import os
+import queue
+import socketserver
+import socket
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 class SpaceTrader:
@@ -11,8 +30,20 @@ class SpaceTrader:
     starting_faction = None
     credits = None
     error = None
-
-    def __init__(self, token=None, callsign=None):
+    trade_index = None
+    exporter = None
+    scheduler = None
+    refresh_planner = None
+    journal = None
+    _overrides = None
+
+    def __init__(self, token=None, callsign=None, exporter=None, scheduler=None, journal=None):
+        self._overrides = threading.local()
+        self.trade_index = TradeIndex()
+        self.refresh_planner = MarketRefreshPlanner()
+        self.exporter = exporter
+        self.scheduler = scheduler
+        self.journal = journal
         if token:
             self.token = token
             self.header = dict(
@@ -34,8 +65,84 @@ class SpaceTrader:
             else:
                 raise NoCallsign()
 
+    @contextmanager
+    def request_priority(self, priority=None, deadline=None):
+        # Applies to every request made by this thread inside the block
+        if priority is not None:
+            if self.scheduler:
+                known = self.scheduler.weights
+            else:
+                known = (RequestScheduler.CRITICAL, RequestScheduler.FLEET, RequestScheduler.BACKGROUND)
+            if priority not in known:
+                raise UnknownPriority(priority, known)
+        previous = getattr(self._overrides, "value", None)
+        self._overrides.value = (priority, deadline)
+        try:
+            yield
+        finally:
+            self._overrides.value = previous
+
+    def _request(self, method, url, priority=None, deadline=None, **kwargs):
+        override = getattr(self._overrides, "value", None)
+        if override:
+            priority = override[0] or priority
+            if override[1] is not None:
+                deadline = override[1]
+
+        if self.scheduler:
+            if priority is None:
+                if method == "get":
+                    priority = RequestScheduler.FLEET
+                else:
+                    priority = RequestScheduler.CRITICAL
+            self.scheduler.acquire(priority, deadline)
+
+        path = url[len(self.BASE_URL):]
+        # Streamed bodies are left for the caller to consume incrementally
+        stream = kwargs.get("stream", False)
+        seq = None
+        if self.journal and method != "get":
+            seq = self.journal.intend(method, path, kwargs.get("data"))
+
+        r = requests.request(method, url, headers=self.header, **kwargs)
+
+        body = None
+        if self.journal and r.status_code in (200, 201) and not stream:
+            body = r.json()
+            # Callers parse the response again, so hand them the body we already decoded
+            r.json = lambda **kwargs: body
+
+        if seq is not None:
+            self.journal.complete(seq, r.status_code, body)
+        elif self.journal and path.startswith("my/ships") and body is not None:
+            self.journal.record_read(path, body)
+        return r
+
+    # Response observers
+    def _observe_market(self, market):
+        self.trade_index.update_market(market)
+        self.refresh_planner.observe_market(market)
+        if self.exporter:
+            self.exporter.record_market(market)
+
+    def _observe_transaction(self, transaction):
+        self.trade_index.update_transaction(transaction)
+        self.refresh_planner.observe_transaction(transaction)
+        if self.exporter:
+            self.exporter.record_transaction(transaction)
+
+    def _observe_waypoint(self, waypoint):
+        self.trade_index.update_waypoint(waypoint)
+        if self.exporter:
+            self.exporter.record_waypoint(waypoint)
+
+    def _observe_waypoints(self, waypoints):
+        for waypoint in waypoints:
+            self._observe_waypoint(waypoint)
+            yield waypoint
+
     def get_status(self):
-        r = requests.get(self.BASE_URL, headers=self.header)
+        r = self._request("get", self.BASE_URL, priority=RequestScheduler.BACKGROUND)
         status = r.json()
         return status
 
@@ -69,7 +176,7 @@ class SpaceTrader:
     def get_agent(self):
         url = self.BASE_URL + "my/agent"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
 
         if r.status_code == 200:
             agent_info = r.json()
@@ -81,7 +188,7 @@ class SpaceTrader:
             return self.error
 
     # Contract Functions
-    def list_contracts(self, limit=10, page=1):
+    def list_contracts(self, limit=10, page=1, stream=False):
         url = self.BASE_URL + "my/contracts"
         if limit > 20:
             limit = 20
@@ -94,9 +201,11 @@ class SpaceTrader:
             page=page
         )
 
-        r = requests.get(url, headers=self.header, params=params)
+        r = self._request("get", url, params=params, stream=stream)
 
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data",))
             contract_list = r.json()
             return contract_list["data"]
         elif r.status_code == 401:
@@ -110,7 +219,7 @@ class SpaceTrader:
     def get_contract(self, contract_id):
         url = self.BASE_URL + f"my/contracts/{contract_id}"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
 
         if r.status_code == 200:
             contract_info = r.json()
@@ -126,7 +235,7 @@ class SpaceTrader:
     def accept_contract(self, contract_id):
         url = self.BASE_URL + f"my/contracts/{contract_id}/accept"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             return 1
         elif r.status_code == 401:
@@ -139,7 +248,7 @@ class SpaceTrader:
     def deliver_cargo_to_contract(self, contract_id):
         url = self.BASE_URL + f"my/contracts/{contract_id}/deliver"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             return 1
         elif r.status_code == 401:
@@ -152,7 +261,7 @@ class SpaceTrader:
     def fulfill_contract(self, contract_id):
         url = self.BASE_URL + f"my/contracts/{contract_id}/fulfill"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             return 1
         elif r.status_code == 401:
@@ -163,7 +272,7 @@ class SpaceTrader:
             return 0
 
     # Faction Functions
-    def list_factions(self, limit=10, page=1):
+    def list_factions(self, limit=10, page=1, stream=False):
         url = self.BASE_URL + f"factions"
 
         if limit > 20:
@@ -177,8 +286,10 @@ class SpaceTrader:
             page=page
         )
 
-        r = requests.get(url, headers=self.header, params=params)
+        r = self._request("get", url, params=params, priority=RequestScheduler.BACKGROUND, stream=stream)
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data",))
             factions_list = r.json()
             return factions_list["data"]
         elif r.status_code == 401:
@@ -192,7 +303,7 @@ class SpaceTrader:
     def get_faction(self, faction_symbol):
         url = self.BASE_URL + f"factions/{faction_symbol}"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             faction_info = r.json()
             return faction_info["data"]
@@ -205,7 +316,7 @@ class SpaceTrader:
             return self.error
 
     # Fleet Functions
-    def list_ships(self, limit=10, page=1):
+    def list_ships(self, limit=10, page=1, stream=False):
         url = self.BASE_URL + f"my/ships"
 
         if limit > 20:
@@ -219,8 +330,10 @@ class SpaceTrader:
             page=page
         )
 
-        r = requests.get(url, headers=self.header, params=params)
+        r = self._request("get", url, params=params, stream=stream)
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data",))
             ship_list = r.json()
             return ship_list["data"]
         elif r.status_code == 401:
@@ -239,7 +352,7 @@ class SpaceTrader:
             waypointSymbol=waypoint
         )
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             ship_info = r.json()
             self.credits = ship_info["agent"]["credits"]
@@ -255,7 +368,7 @@ class SpaceTrader:
     def get_ship(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
         if r.status_code == 200:
             ship_info = r.json()
             return ship_info["data"]
@@ -270,7 +383,7 @@ class SpaceTrader:
     def get_ship_cargo(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/cargo"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
         if r.status_code == 200:
             cargo_info = r.json()
             return cargo_info["data"]
@@ -285,7 +398,7 @@ class SpaceTrader:
     def orbit_ship(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/orbit"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -300,7 +413,7 @@ class SpaceTrader:
     def refine_material(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/refine"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -315,7 +428,7 @@ class SpaceTrader:
     def create_chart(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/chart"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             chart_info = r.json()
             return chart_info["data"]
@@ -330,7 +443,7 @@ class SpaceTrader:
     def get_ship_cooldown(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/cooldown"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
         if r.status_code == 200:
             chart_info = r.json()
             return chart_info["data"]
@@ -345,7 +458,7 @@ class SpaceTrader:
     def dock_ship(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/dock"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -360,7 +473,7 @@ class SpaceTrader:
     def create_survey(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/survey"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             survey_info = r.json()
             return survey_info["data"]
@@ -375,9 +488,11 @@ class SpaceTrader:
     def extract_resources(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/extract"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url)
         if r.status_code == 200:
             survey_info = r.json()
+            if self.exporter:
+                self.exporter.record_extraction(survey_info["data"]["extraction"])
             return survey_info["data"]
         elif r.status_code == 401:
             raise TokenError()
@@ -395,7 +510,7 @@ class SpaceTrader:
             units=quantity
         )
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             cargo_info = r.json()
             return cargo_info["data"]
@@ -412,7 +527,7 @@ class SpaceTrader:
 
         data = dict(systemSymbol=system)
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             jump_info = r.json()
             return jump_info["data"]
@@ -429,7 +544,7 @@ class SpaceTrader:
 
         data = dict(systemSymbol=system)
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -446,7 +561,7 @@ class SpaceTrader:
 
         data = dict(flightMode=flight_mode)
 
-        r = requests.patch(url, headers=self.header, data=data)
+        r = self._request("patch", url, data=data)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -461,7 +576,7 @@ class SpaceTrader:
     def get_ship_nav(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/nav"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -478,7 +593,7 @@ class SpaceTrader:
 
         data = dict(waypointSymbol=waypoint)
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             nav_info = r.json()
             return nav_info["data"]
@@ -498,9 +613,10 @@ class SpaceTrader:
             units=quantity,
         )
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             cargo_info = r.json()
+            self._observe_transaction(cargo_info["data"]["transaction"])
             return cargo_info["data"]
         elif r.status_code == 401:
             raise TokenError()
@@ -510,11 +626,13 @@ class SpaceTrader:
             self.error = r.json()
             return self.error
 
-    def scan_systems(self, ship_id):
+    def scan_systems(self, ship_id, stream=False):
         url = self.BASE_URL + f"my/ships/{ship_id}/scan/systems"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url, stream=stream, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data", "systems"))
             system_info = r.json()
             return system_info["data"]
         elif r.status_code == 401:
@@ -525,11 +643,13 @@ class SpaceTrader:
             self.error = r.json()
             return self.error
 
-    def scan_waypoints(self, ship_id):
+    def scan_waypoints(self, ship_id, stream=False):
         url = self.BASE_URL + f"my/ships/{ship_id}/scan/waypoints"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url, stream=stream, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data", "waypoints"))
             waypoint_info = r.json()
             return waypoint_info["data"]
         elif r.status_code == 401:
@@ -540,11 +660,13 @@ class SpaceTrader:
             self.error = r.json()
             return self.error
 
-    def scan_ships(self, ship_id):
+    def scan_ships(self, ship_id, stream=False):
         url = self.BASE_URL + f"my/ships/{ship_id}/scan/ships"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url, stream=stream, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data", "ships"))
             ship_info = r.json()
             return ship_info["data"]
         elif r.status_code == 401:
@@ -560,7 +682,7 @@ class SpaceTrader:
 
         data = dict(units=quantity)
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             refuel_info = r.json()
             return refuel_info["data"]
@@ -580,9 +702,10 @@ class SpaceTrader:
             units=quantity,
         )
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             cargo_info = r.json()
+            self._observe_transaction(cargo_info["data"]["transaction"])
             return cargo_info["data"]
         elif r.status_code == 401:
             raise TokenError()
@@ -601,7 +724,7 @@ class SpaceTrader:
             shipSymbol=recipient,
         )
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             cargo_info = r.json()
             return cargo_info["data"]
@@ -616,7 +739,7 @@ class SpaceTrader:
     def negotiate_contract(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/negotiate/contract"
 
-        r = requests.post(url, headers=self.header)
+        r = self._request("post", url, priority=RequestScheduler.FLEET)
         if r.status_code == 200:
             contract_info = r.json()
             return contract_info["data"]
@@ -631,7 +754,7 @@ class SpaceTrader:
     def get_mounts(self, ship_id):
         url = self.BASE_URL + f"my/ships/{ship_id}/mounts"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url)
         if r.status_code == 200:
             mount_info = r.json()
             return mount_info["data"]
@@ -648,7 +771,7 @@ class SpaceTrader:
 
         data = dict(symbol=mount)
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             mount_info = r.json()
             return mount_info["data"]
@@ -665,7 +788,7 @@ class SpaceTrader:
 
         data = dict(symbol=mount)
 
-        r = requests.post(url, headers=self.header, data=data)
+        r = self._request("post", url, data=data)
         if r.status_code == 200:
             mount_info = r.json()
             return mount_info["data"]
@@ -678,7 +801,7 @@ class SpaceTrader:
             return self.error
 
     # System Functions
-    def list_systems(self, limit=10, page=1):
+    def list_systems(self, limit=10, page=1, stream=False):
         url = self.BASE_URL + f"systems"
 
         if limit > 20:
@@ -692,8 +815,10 @@ class SpaceTrader:
             page=page
         )
 
-        r = requests.get(url, headers=self.header, params=params)
+        r = self._request("get", url, params=params, priority=RequestScheduler.BACKGROUND, stream=stream)
         if r.status_code == 200:
+            if stream:
+                return iter_json_items(r, ("data",))
             system_list = r.json()
             return system_list["data"]
         elif r.status_code == 401:
@@ -707,7 +832,7 @@ class SpaceTrader:
     def get_system(self, system):
         url = self.BASE_URL + f"systems/X1-{system}"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             system_info = r.json()
             return system_info["data"]
@@ -719,7 +844,7 @@ class SpaceTrader:
             self.error = r.json()
             return self.error
 
-    def list_waypoints_in_system(self, system, limit=10, page=1):
+    def list_waypoints_in_system(self, system, limit=10, page=1, stream=False):
         url = self.BASE_URL + f"systems/X1-{system}/waypoints"
 
         if limit > 20:
@@ -733,9 +858,13 @@ class SpaceTrader:
             page=page
         )
 
-        r = requests.get(url, headers=self.header, params=params)
+        r = self._request("get", url, params=params, priority=RequestScheduler.BACKGROUND, stream=stream)
         if r.status_code == 200:
+            if stream:
+                return self._observe_waypoints(iter_json_items(r, ("data",)))
             waypoint_list = r.json()
+            for waypoint_info in waypoint_list["data"]:
+                self._observe_waypoint(waypoint_info)
             return waypoint_list["data"]
         elif r.status_code == 401:
             raise TokenError()
@@ -748,9 +877,10 @@ class SpaceTrader:
     def get_waypoint(self, system, waypoint):
         url = self.BASE_URL + f"systems/X1-{system}/waypoints/X1-{system}-{waypoint}"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             waypoint_info = r.json()
+            self._observe_waypoint(waypoint_info["data"])
             return waypoint_info["data"]
         elif r.status_code == 401:
             raise TokenError()
@@ -763,9 +893,10 @@ class SpaceTrader:
     def get_market(self, system, waypoint):
         url = self.BASE_URL + f"systems/X1-{system}/waypoints/X1-{system}-{waypoint}/market"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             market_info = r.json()
+            self._observe_market(market_info["data"])
             return market_info["data"]
         elif r.status_code == 401:
             raise TokenError()
@@ -778,7 +909,7 @@ class SpaceTrader:
     def get_shipyard(self, system, waypoint):
         url = self.BASE_URL + f"systems/X1-{system}/waypoints/X1-{system}-{waypoint}/shipyard"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             shipyard_info = r.json()
             return shipyard_info["data"]
@@ -793,7 +924,7 @@ class SpaceTrader:
     def get_jump_gate(self, system, waypoint):
         url = self.BASE_URL + f"systems/X1-{system}/waypoints/X1-{system}-{waypoint}/jump-gate"
 
-        r = requests.get(url, headers=self.header)
+        r = self._request("get", url, priority=RequestScheduler.BACKGROUND)
         if r.status_code == 200:
             jump_gate_info = r.json()
             return jump_gate_info["data"]
@@ -806,6 +937,975 @@ class SpaceTrader:
             return self.error
 
 
+# Streaming Functions
+def iter_json_items(r, path, chunk_size=65536):
+    # Release the connection even when the caller stops iterating early
+    try:
+        yield from _iter_json_array(r.iter_content(chunk_size=chunk_size), path)
+    finally:
+        r.close()
+
+
+def _iter_json_array(chunks, path):
+    # Yields the elements of the array found at key path as soon as each one is complete,
+    # skipping over anything else in the document without building it
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    eof = False
+    mode = "value"
+    keys = ()
+    key = ()
+
+    while True:
+        more = False
+        while pos < len(buf) and buf[pos] in " \t\r\n":
+            pos += 1
+
+        if pos == len(buf):
+            more = True
+        elif mode == "items":
+            if buf[pos] == ",":
+                pos += 1
+            elif buf[pos] == "]":
+                return
+            else:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    more = True
+                else:
+                    if _scalar_may_continue(buf, end, item, eof):
+                        more = True
+                    else:
+                        pos = end
+                        yield item
+        elif mode == "object":
+            if buf[pos] == ",":
+                pos += 1
+            elif buf[pos] == "}":
+                return
+            else:
+                try:
+                    name, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    more = True
+                else:
+                    colon = buf.find(":", end)
+                    if colon == -1:
+                        more = True
+                    else:
+                        pos = colon + 1
+                        key = keys + (name,)
+                        mode = "value"
+        elif buf[pos] == "[" and key == path:
+            pos += 1
+            mode = "items"
+        elif buf[pos] == "{" and key == path[:len(key)]:
+            pos += 1
+            keys = key
+            mode = "object"
+        else:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                more = True
+            else:
+                if _scalar_may_continue(buf, end, value, eof):
+                    more = True
+                else:
+                    pos = end
+                    mode = "object"
+
+        if more:
+            if eof:
+                raise ValueError("Response ended before the JSON array was complete")
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                buf = buf[pos:] + utf8.decode(b"", final=True)
+            else:
+                buf = buf[pos:] + utf8.decode(chunk)
+            pos = 0
+
+
+def _scalar_may_continue(buf, end, value, eof):
+    # raw_decode happily stops at "538." or "1e", so a number or literal only counts as
+    # complete once a delimiter shows it really ended
+    if eof or isinstance(value, (dict, list, str)):
+        return False
+    while end < len(buf) and buf[end] in " \t\r\n":
+        end += 1
+    return end == len(buf) or buf[end] not in ",]}"
+
+
+# Scheduler Functions
+class RequestScheduler:
+    CRITICAL = "critical"
+    FLEET = "fleet"
+    BACKGROUND = "background"
+
+    def __init__(self, rate=2, burst=10, weights=None, max_wait=None):
+        self.rate = rate
+        self.burst = burst
+        if weights is None:
+            weights = {self.CRITICAL: 8, self.FLEET: 4, self.BACKGROUND: 1}
+        self.weights = weights
+        self.max_wait = max_wait or {}
+        self._tokens = burst
+        self._refilled = time.time()
+        self._clock = 0.0
+        self._queues = {priority: deque() for priority in weights}
+        self._virtual = {priority: 0.0 for priority in weights}
+        self._stats = {
+            priority: dict(granted=0, dropped=0, total_wait=0.0, max_wait=0.0)
+            for priority in weights
+        }
+        self._lock = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _head(self):
+        waiting = [priority for priority in self._queues if self._queues[priority]]
+        if not waiting:
+            return None
+        return self._queues[min(waiting, key=lambda priority: self._virtual[priority])][0]
+
+    def acquire(self, priority, deadline=None):
+        if priority not in self.weights:
+            raise UnknownPriority(priority, self.weights)
+        queued = time.time()
+        if deadline is None and self.max_wait.get(priority) is not None:
+            deadline = queued + self.max_wait[priority]
+        ticket = object()
+
+        with self._lock:
+            waiting = self._queues[priority]
+            # A class coming back from idle starts at the current virtual time instead of its stale one
+            if not waiting:
+                self._virtual[priority] = max(self._virtual[priority], self._clock)
+            waiting.append(ticket)
+            try:
+                while True:
+                    now = time.time()
+                    if deadline is not None and now >= deadline:
+                        self._stats[priority]["dropped"] += 1
+                        raise RequestExpired(priority)
+
+                    self._refill(now)
+                    is_head = self._head() is ticket
+                    if is_head and self._tokens >= 1:
+                        self._tokens -= 1
+                        self._clock = self._virtual[priority]
+                        self._virtual[priority] += 1 / self.weights[priority]
+                        wait = now - queued
+                        stats = self._stats[priority]
+                        stats["granted"] += 1
+                        stats["total_wait"] += wait
+                        stats["max_wait"] = max(stats["max_wait"], wait)
+                        return wait
+
+                    timeout = None
+                    if is_head:
+                        timeout = (1 - self._tokens) / self.rate
+                    if deadline is not None:
+                        timeout = min(timeout or deadline - now, deadline - now)
+                    self._lock.wait(timeout)
+            finally:
+                waiting.remove(ticket)
+                self._lock.notify_all()
+
+    def metrics(self):
+        with self._lock:
+            metrics = {}
+            for priority, stats in self._stats.items():
+                metrics[priority] = dict(
+                    stats,
+                    queued=len(self._queues[priority]),
+                    mean_wait=stats["total_wait"] / stats["granted"] if stats["granted"] else 0.0,
+                )
+            return metrics
+
+
+# Cargo Functions
+class CargoConsolidator:
+    MINER_ROLES = ("EXCAVATOR",)
+    HAULER_ROLES = ("HAULER", "TRANSPORT")
+
+    def __init__(self, client, max_workers=4, trade_index=None):
+        self.client = client
+        self.max_workers = max_workers
+        # A daemon stub can't hand over its index, so only a local client's is picked up
+        if trade_index is None and isinstance(client, SpaceTrader):
+            trade_index = client.trade_index
+        self.trade_index = trade_index
+
+    def group_by_waypoint(self, ships):
+        groups = {}
+        for ship in ships:
+            waypoint = ship["nav"]["waypointSymbol"]
+            if ship["nav"]["status"] == "IN_TRANSIT":
+                continue
+            groups.setdefault(waypoint, []).append(ship)
+        return groups
+
+    def unit_value(self, market, cargo):
+        # Jettisoning can't be undone, so only a listed sell price of 0 makes a good worthless;
+        # anything we merely don't know about is None
+        if market is not None:
+            for good in market.get("tradeGoods", []):
+                if good["symbol"] == cargo:
+                    return good["sellPrice"]
+        if self.trade_index:
+            prices = [
+                entry["sellPrice"]
+                for entry in self.trade_index.markets(cargo, ("import", "exchange")).values()
+                if entry["sellPrice"]
+            ]
+            if prices:
+                return max(prices)
+        return None
+
+    def plan(self, ships, markets=None):
+        if markets is None:
+            markets = {}
+        transfers = []
+        jettisons = []
+
+        for waypoint, group in self.group_by_waypoint(ships).items():
+            miners = [s for s in group if s["registration"]["role"] in self.MINER_ROLES]
+            haulers = [s for s in group if s["registration"]["role"] in self.HAULER_ROLES]
+            market = markets.get(waypoint)
+
+            space = {h["symbol"]: h["cargo"]["capacity"] - h["cargo"]["units"] for h in haulers}
+            stacks = []
+            for miner in miners:
+                for item in miner["cargo"]["inventory"]:
+                    value = self.unit_value(market, item["symbol"])
+                    stacks.append((value != 0, value or 0, miner["symbol"], item["symbol"], item["units"]))
+
+            # Most valuable goods get hauler space first, known-worthless goods only what is left
+            stacks.sort(key=lambda stack: stack[:2], reverse=True)
+            for valued, value, miner, cargo, units in stacks:
+                while units > 0:
+                    open_haulers = [h for h in space if space[h] > 0]
+                    if not open_haulers:
+                        break
+                    # Best fit keeps a stack in one transfer whenever a single hauler can take it
+                    fits = [h for h in open_haulers if space[h] >= units]
+                    if fits:
+                        hauler = min(fits, key=lambda h: space[h])
+                    else:
+                        hauler = max(open_haulers, key=lambda h: space[h])
+                    moved = min(units, space[hauler])
+                    transfers.append((miner, cargo, moved, hauler))
+                    space[hauler] -= moved
+                    units -= moved
+                if units > 0 and not valued:
+                    jettisons.append((miner, cargo, units))
+
+        return transfers, jettisons
+
+    def consolidate(self, ships=None, markets=None):
+        if ships is None:
+            ships = []
+            page = 1
+            while True:
+                ship_list = self.client.list_ships(limit=20, page=page)
+                if not isinstance(ship_list, list):
+                    raise RequestFailed(ship_list)
+                ships.extend(ship_list)
+                if len(ship_list) < 20:
+                    break
+                page += 1
+        transfers, jettisons = self.plan(ships, markets)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            transfer_results = list(pool.map(
+                lambda t: self.client.transfer_cargo(*t), transfers
+            ))
+            jettison_results = list(pool.map(
+                lambda j: self.client.jettison_cargo(*j), jettisons
+            ))
+
+        return dict(
+            transfers=list(zip(transfers, transfer_results)),
+            jettisons=list(zip(jettisons, jettison_results)),
+        )
+
+
+# Market Functions
+class TradeIndex:
+    def __init__(self):
+        self.goods = {}
+        self.waypoints = {}
+
+    def _entry(self, trade_symbol, market_symbol):
+        markets = self.goods.setdefault(trade_symbol, {})
+        return markets.setdefault(market_symbol, dict(
+            kinds=set(),
+            purchasePrice=None,
+            sellPrice=None,
+            supply=None,
+            tradeVolume=None,
+            updated=None,
+        ))
+
+    def update_waypoint(self, waypoint):
+        # Coordinates are only comparable within one system
+        self.waypoints[waypoint["symbol"]] = (waypoint["systemSymbol"], waypoint["x"], waypoint["y"])
+
+    def update_market(self, market):
+        market_symbol = market["symbol"]
+        kinds = {}
+        for kind, key in (("import", "imports"), ("export", "exports"), ("exchange", "exchange")):
+            for good in market.get(key, []):
+                kinds.setdefault(good["symbol"], set()).add(kind)
+
+        # A full snapshot replaces what we knew, so goods the market dropped stop matching
+        if any(key in market for key in ("imports", "exports", "exchange")):
+            for trade_symbol, markets in self.goods.items():
+                if market_symbol in markets:
+                    markets[market_symbol]["kinds"] = kinds.get(trade_symbol, set())
+            for trade_symbol, good_kinds in kinds.items():
+                self._entry(trade_symbol, market_symbol)["kinds"] = good_kinds
+
+        now = time.time()
+        for good in market.get("tradeGoods", []):
+            entry = self._entry(good["symbol"], market_symbol)
+            entry["purchasePrice"] = good["purchasePrice"]
+            entry["sellPrice"] = good["sellPrice"]
+            entry["supply"] = good.get("supply")
+            entry["tradeVolume"] = good.get("tradeVolume")
+            entry["updated"] = now
+
+    def update_transaction(self, transaction):
+        entry = self._entry(transaction["tradeSymbol"], transaction["waypointSymbol"])
+        if transaction["type"] == "SELL":
+            entry["sellPrice"] = transaction["pricePerUnit"]
+            kind = "import"
+        else:
+            entry["purchasePrice"] = transaction["pricePerUnit"]
+            kind = "export"
+        # Until we see the market itself, the trade tells us which way it deals in the good
+        if not entry["kinds"]:
+            entry["kinds"].add(kind)
+        entry["updated"] = time.time()
+
+    def markets(self, trade_symbol, kinds=("import", "export", "exchange")):
+        return {
+            market: entry
+            for market, entry in self.goods.get(trade_symbol, {}).items()
+            if entry["kinds"].intersection(kinds)
+        }
+
+    def nearest(self, trade_symbol, system, x, y, kinds=("import", "exchange")):
+        best = None
+        for market, entry in self.markets(trade_symbol, kinds).items():
+            if market not in self.waypoints:
+                continue
+            market_system, mx, my = self.waypoints[market]
+            if market_system != system:
+                continue
+            distance = math.hypot(mx - x, my - y)
+            if best is None or distance < best[1]:
+                best = (market, distance, entry)
+        return best
+
+    def nearest_to_waypoint(self, trade_symbol, waypoint, kinds=("import", "exchange")):
+        if waypoint not in self.waypoints:
+            return None
+        return self.nearest(trade_symbol, *self.waypoints[waypoint], kinds=kinds)
+
+
+class MarketRefreshPlanner:
+    def __init__(self, default_volatility=0.0001, smoothing=0.3):
+        # Volatility is relative price change per second
+        self.default_volatility = default_volatility
+        self.smoothing = smoothing
+        self.prices = {}
+        self.relevance = {}
+
+    def set_relevance(self, market, weight):
+        self.relevance[market] = weight
+
+    def observe(self, market, good, side, price, now=None, snapshot=True):
+        if now is None:
+            now = time.time()
+        key = (market, good, side)
+        previous = self.prices.get(key)
+        if previous is None:
+            previous = self.prices[key] = dict(
+                price=price,
+                observed=now,
+                snapshot_price=None,
+                snapshot_observed=None,
+                volatility=self.default_volatility,
+            )
+
+        # Only market snapshots feed volatility, our own trades move the price they report
+        if snapshot:
+            if previous["snapshot_price"] is not None:
+                elapsed = now - previous["snapshot_observed"]
+                if elapsed > 0:
+                    change = abs(price - previous["snapshot_price"]) / max(previous["snapshot_price"], 1) / elapsed
+                    previous["volatility"] += self.smoothing * (change - previous["volatility"])
+            previous["snapshot_price"] = price
+            previous["snapshot_observed"] = now
+        previous["price"] = price
+        previous["observed"] = now
+
+    def observe_market(self, market, now=None):
+        for good in market.get("tradeGoods", []):
+            self.observe(market["symbol"], good["symbol"], "sellPrice", good["sellPrice"], now)
+            self.observe(market["symbol"], good["symbol"], "purchasePrice", good["purchasePrice"], now)
+
+    def observe_transaction(self, transaction, now=None):
+        side = "sellPrice" if transaction["type"] == "SELL" else "purchasePrice"
+        self.observe(
+            transaction["waypointSymbol"], transaction["tradeSymbol"], side, transaction["pricePerUnit"], now,
+            snapshot=False,
+        )
+
+    def scores(self, now=None):
+        if now is None:
+            now = time.time()
+        # Mean expected relative price drift since each good was last seen, so big markets don't always win
+        drift = {market: [] for market in self.relevance}
+        for (market, good, side), seen in self.prices.items():
+            drift.setdefault(market, []).append(seen["volatility"] * (now - seen["observed"]))
+
+        scores = {}
+        for market, expected in drift.items():
+            if not expected:
+                scores[market] = float("inf")
+            else:
+                scores[market] = sum(expected) / len(expected) * (1 + self.relevance.get(market, 0))
+        return scores
+
+    def plan(self, budget, now=None):
+        scores = self.scores(now)
+        ranked = sorted(scores, key=lambda market: scores[market], reverse=True)
+        return [market for market in ranked[:budget] if scores[market] > 0]
+
+
+# Export Functions
+class DataExporter:
+    def __init__(self, path, batch_size=1000, max_pending=10000, flush_interval=60.0, on_batch=None):
+        if pyarrow is None:
+            raise MissingDependency("pyarrow")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_batch = on_batch
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.parts = {}
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._buffers = {}
+        self._flushed = time.time()
+        self._closed = threading.Event()
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def _record(self, table, row):
+        if self._closed.is_set():
+            self.dropped += 1
+            return
+        row["recorded"] = time.time()
+        # Never block the bot's request loop; shed rows when the writer falls behind
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_market(self, market):
+        for good in market.get("tradeGoods", []):
+            self._record("markets", dict(
+                market=market["symbol"],
+                symbol=good["symbol"],
+                supply=good.get("supply"),
+                tradeVolume=good.get("tradeVolume"),
+                purchasePrice=good["purchasePrice"],
+                sellPrice=good["sellPrice"],
+            ))
+
+    def record_extraction(self, extraction):
+        self._record("extractions", dict(
+            shipSymbol=extraction["shipSymbol"],
+            symbol=extraction["yield"]["symbol"],
+            units=extraction["yield"]["units"],
+        ))
+
+    def record_transaction(self, transaction):
+        self._record("transactions", dict(
+            waypointSymbol=transaction["waypointSymbol"],
+            shipSymbol=transaction["shipSymbol"],
+            tradeSymbol=transaction["tradeSymbol"],
+            type=transaction["type"],
+            units=transaction["units"],
+            pricePerUnit=transaction["pricePerUnit"],
+            totalPrice=transaction["totalPrice"],
+            timestamp=transaction["timestamp"],
+        ))
+
+    def record_waypoint(self, waypoint):
+        self._record("waypoints", dict(
+            symbol=waypoint["symbol"],
+            type=waypoint["type"],
+            systemSymbol=waypoint["systemSymbol"],
+            x=waypoint["x"],
+            y=waypoint["y"],
+        ))
+
+    def _run(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                table, row = self._queue.get(timeout=min(self.flush_interval, 1.0))
+            except queue.Empty:
+                pass
+            else:
+                rows = self._buffers.setdefault(table, [])
+                rows.append(row)
+                if len(rows) >= self.batch_size:
+                    self._write(table)
+            # Low-volume bots would otherwise hold rows until close
+            if time.time() - self._flushed >= self.flush_interval:
+                self._flush()
+        self._flush()
+
+    def _flush(self):
+        for table in list(self._buffers):
+            self._write(table)
+        self._flushed = time.time()
+
+    def _write(self, table):
+        rows = self._buffers.pop(table, [])
+        if not rows:
+            return
+        # A bad batch loses its own rows but must not take the writer thread down
+        try:
+            self._write_rows(table, rows)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = e
+
+    def _write_rows(self, table, rows):
+        partitions = {}
+        for row in rows:
+            date = time.strftime("%Y-%m-%d", time.gmtime(row["recorded"]))
+            partitions.setdefault(date, []).append(row)
+
+        for date, partition in partitions.items():
+            batch = pyarrow.RecordBatch.from_pylist(partition)
+            directory = os.path.join(self.path, table, f"date={date}")
+            os.makedirs(directory, exist_ok=True)
+            part = self.parts.get(table, 0)
+            self.parts[table] = part + 1
+            filename = os.path.join(directory, f"part-{int(partition[0]['recorded'])}-{part:05d}.parquet")
+            pyarrow.parquet.write_table(pyarrow.Table.from_batches([batch]), filename)
+
+            # The file is already safe, so a failing callback only costs the callback
+            if self.on_batch:
+                try:
+                    self.on_batch(table, batch)
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = e
+
+    def close(self):
+        self._closed.set()
+        self._writer.join()
+        # Rows that slipped in while the writer was exiting will never be written
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self.dropped += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Journal Functions
+class ActionJournal:
+    def __init__(self, path, sync_every=32, sync_interval=1.0, compact_every=10000):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.seq = 0
+        self.agent = None
+        self.ships = {}
+        self.plans = {}
+        self.pending = {}
+        self.stale = {}
+        self._records = 0
+        self._unsynced = 0
+        self._synced = time.time()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        break
+                    self._apply(record)
+                    self._records += 1
+        self._file = open(path, "a")
+
+    # Recording
+    def _append(self, record):
+        with self._lock:
+            self._apply(record)
+            self._file.write(json.dumps(record) + "\n")
+            # Reach the OS on every record so a killed process never loses a sent intent; fsync stays batched
+            self._file.flush()
+            self._records += 1
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.time() - self._synced >= self.sync_interval:
+                self._sync()
+            if self._records >= self.compact_every:
+                self._compact()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced = time.time()
+
+    def intend(self, method, path, data=None):
+        with self._lock:
+            self.seq += 1
+            seq = self.seq
+        self._append(dict(kind="intent", seq=seq, method=method, path=path, data=data, time=time.time()))
+        return seq
+
+    def complete(self, seq, status, response):
+        self._append(dict(kind="done", seq=seq, status=status, response=response))
+
+    def record_read(self, path, response):
+        self._append(dict(kind="read", path=path, response=response))
+
+    def record_plan(self, plan_id, step, state=None):
+        self._append(dict(kind="plan", plan=plan_id, step=step, state=state))
+
+    def finish_plan(self, plan_id):
+        self._append(dict(kind="plan", plan=plan_id, step=None, state=None))
+
+    # Replay
+    def _apply(self, record):
+        kind = record["kind"]
+        if kind == "snapshot":
+            self.seq = record["seq"]
+            self.agent = record["agent"]
+            self.ships = record["ships"]
+            self.plans = record["plans"]
+            self.pending = {int(seq): intent for seq, intent in record["pending"].items()}
+            self.stale = {ship: set(parts) for ship, parts in record["stale"].items()}
+        elif kind == "intent":
+            self.seq = max(self.seq, record["seq"])
+            self.pending[record["seq"]] = record
+        elif kind == "done":
+            intent = self.pending.pop(record["seq"], None)
+            if intent and record["response"] is not None:
+                self._apply_response(intent["path"], record["response"], intent["data"])
+        elif kind == "read":
+            self._apply_response(record["path"], record["response"])
+        elif kind == "stale":
+            self.stale.setdefault(record["ship"], set()).update(record["parts"])
+        elif kind == "plan":
+            if record["step"] is None:
+                self.plans.pop(record["plan"], None)
+            else:
+                self.plans[record["plan"]] = dict(step=record["step"], state=record["state"])
+
+    def _apply_response(self, path, response, request=None):
+        data = response.get("data")
+        if path == "my/agent":
+            self.agent = data
+            return
+        if isinstance(data, dict) and "agent" in data:
+            self.agent = data["agent"]
+
+        parts = path.split("/")
+        if parts[:2] != ["my", "ships"] or data is None:
+            return
+        if len(parts) == 2:
+            ships = data if isinstance(data, list) else [data.get("ship")]
+            for ship in ships:
+                if ship:
+                    self.ships[ship["symbol"]] = ship
+                    self.stale.pop(ship["symbol"], None)
+            return
+
+        symbol = parts[2]
+        if len(parts) == 3:
+            self.ships[symbol] = data
+            self.stale.pop(symbol, None)
+            return
+
+        ship = self.ships.setdefault(symbol, dict(symbol=symbol))
+        fresh = set()
+        if parts[3] in ("nav", "cargo", "cooldown"):
+            ship[parts[3]] = data
+            fresh.add(parts[3])
+        else:
+            for key in ("nav", "cargo", "fuel", "cooldown"):
+                if key in data:
+                    ship[key] = data[key]
+                    fresh.add(key)
+        if symbol in self.stale:
+            self.stale[symbol] -= fresh
+            if not self.stale[symbol]:
+                del self.stale[symbol]
+
+        # The recipient's hold changed too, but the response only describes ours
+        if parts[3] == "transfer" and request:
+            self.stale.setdefault(request["shipSymbol"], set()).add("cargo")
+
+    # Compaction
+    def _compact(self):
+        snapshot = dict(
+            kind="snapshot",
+            seq=self.seq,
+            agent=self.agent,
+            ships=self.ships,
+            plans=self.plans,
+            pending=self.pending,
+            stale={ship: sorted(parts) for ship, parts in self.stale.items()},
+        )
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(json.dumps(snapshot) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a")
+        self._records = 1
+        self._unsynced = 0
+        self._synced = time.time()
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    # Resume
+    def resume(self, client):
+        # A client journaling to us records its own ship reads
+        journaled = getattr(client, "journal", None) is self
+
+        # Intents with no recorded outcome may or may not have reached the server
+        purchased = False
+        unresolved = bool(self.pending)
+        for intent in list(self.pending.values()):
+            parts = intent["path"].split("/")
+            if parts[:2] == ["my", "ships"] and len(parts) > 3:
+                self.stale.setdefault(parts[2], set()).update(("nav", "cargo"))
+            elif parts == ["my", "ships"]:
+                purchased = True
+
+        # Any of them could have spent or earned credits; keep them pending if we can't check
+        verified = True
+        if unresolved:
+            agent_info = client.get_agent()
+            if isinstance(agent_info, dict) and "error" not in agent_info:
+                self.record_read("my/agent", dict(data=agent_info))
+            else:
+                verified = False
+        if purchased:
+            page = 1
+            while True:
+                ship_list = client.list_ships(limit=20, page=page)
+                if not isinstance(ship_list, list):
+                    verified = False
+                    break
+                if not journaled:
+                    self.record_read("my/ships", dict(data=ship_list))
+                if len(ship_list) < 20:
+                    break
+                page += 1
+        if verified:
+            # Outcome unknown but checked against the server, so close the intents out on disk too
+            for seq in list(self.pending):
+                self.complete(seq, None, None)
+
+        now = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+        for symbol, ship in self.ships.items():
+            nav = ship.get("nav")
+            if nav and nav["status"] == "IN_TRANSIT" and nav["route"]["arrival"][:19] <= now and symbol not in self.stale:
+                nav["status"] = "IN_ORBIT"
+                nav["waypointSymbol"] = nav["route"]["destination"]["symbol"]
+
+        for symbol, parts in list(self.stale.items()):
+            if len(parts) > 1 or symbol not in self.ships:
+                path, data = f"my/ships/{symbol}", client.get_ship(symbol)
+            elif "nav" in parts:
+                path, data = f"my/ships/{symbol}/nav", client.get_ship_nav(symbol)
+            else:
+                path, data = f"my/ships/{symbol}/cargo", client.get_ship_cargo(symbol)
+            # Ships whose read failed stay stale, durably, for the next resume
+            if not isinstance(data, dict) or "error" in data:
+                self._append(dict(kind="stale", ship=symbol, parts=sorted(parts)))
+                continue
+            if not journaled:
+                self.record_read(path, dict(data=data))
+            self.stale.pop(symbol, None)
+
+        with self._lock:
+            self._sync()
+        return dict(agent=self.agent, ships=self.ships, plans=self.plans)
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Daemon Functions
+class SpaceTraderDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Only these are served; token, header and register_agent never leave the daemon
+    METHODS = (
+        "get_status", "get_agent", "list_contracts", "get_contract", "accept_contract",
+        "deliver_cargo_to_contract", "fulfill_contract", "list_factions", "get_faction",
+        "list_ships", "purchase_ship", "get_ship", "get_ship_cargo", "orbit_ship",
+        "refine_material", "create_chart", "get_ship_cooldown", "dock_ship", "create_survey",
+        "extract_resources", "jettison_cargo", "jump_ship", "navigate_ship", "patch_ship_nav",
+        "get_ship_nav", "warp_ship", "sell_cargo", "scan_systems", "scan_waypoints", "scan_ships",
+        "refuel_ship", "purchase_cargo", "transfer_cargo", "negotiate_contract", "get_mounts",
+        "install_mount", "remove_mount", "list_systems", "get_system", "list_waypoints_in_system",
+        "get_waypoint", "get_market", "get_shipyard", "get_jump_gate",
+    )
+    ATTRIBUTES = ("callsign", "headquarters", "starting_faction", "credits")
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        if os.path.exists(path):
+            # Only clear out a stale socket, never some other file that happens to be there
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            os.remove(path)
+        super().__init__(path, _DaemonHandler)
+
+    def server_bind(self):
+        # Create the socket owner-only from the start so there is no window before a chmod
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = json.dumps(self.dispatch(json.loads(line)))
+            except Exception as e:
+                reply = json.dumps(dict(error=type(e).__name__, message=str(e)))
+            self.wfile.write(reply.encode() + b"\n")
+            self.wfile.flush()
+
+    def dispatch(self, request):
+        name = request["name"]
+        if request["op"] == "getattr":
+            if name in self.server.METHODS:
+                return dict(callable=True)
+            if name in self.server.ATTRIBUTES:
+                return dict(value=getattr(self.server.client, name))
+        elif name in self.server.METHODS:
+            if request["kwargs"].get("stream"):
+                return dict(error="ValueError", message="stream=True is not supported over the daemon")
+            try:
+                return dict(value=getattr(self.server.client, name)(*request["args"], **request["kwargs"]))
+            except Exception as e:
+                return dict(error=type(e).__name__, message=str(e))
+        return dict(error="AttributeError", message=f"{name} is not available")
+
+
+class SpaceTraderClient:
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._file = self._sock.makefile("rwb")
+        self._methods = {}
+
+    def _call(self, request):
+        self._file.write(json.dumps(request).encode() + b"\n")
+        self._file.flush()
+        reply = json.loads(self._file.readline())
+        if "error" in reply:
+            raise _remote_exception(reply["error"], reply["message"])
+        return reply
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._methods:
+            return self._methods[name]
+
+        reply = self._call(dict(op="getattr", name=name))
+        if not reply.get("callable"):
+            return reply["value"]
+
+        def method(*args, **kwargs):
+            return self._call(dict(op="call", name=name, args=args, kwargs=kwargs))["value"]
+
+        self._methods[name] = method
+        return method
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _remote_exception(name, message):
+    cls = globals().get(name)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        # Our exceptions build their own message, so skip their __init__
+        e = cls.__new__(cls)
+        Exception.__init__(e, message)
+        e.message = message
+        return e
+    # Builtins such as AttributeError keep hasattr and getattr defaults working on the stub
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        try:
+            return cls(message)
+        except TypeError:
+            pass
+    return RemoteError(name, message)
+
+
 # Exceptions
 class NoCallsign(Exception):
     def __init__(self):
@@ -835,3 +1935,45 @@ class ResourceNotFound(Exception):
     def __init__(self):
         self.message = "The requested resource could not be found"
         super().__init__(self.message)
+
+
+class RequestFailed(Exception):
+    def __init__(self, error):
+        self.error = error
+        self.message = f"Request failed: {error}"
+        super().__init__(self.message)
+
+
+class UnknownPriority(Exception):
+    def __init__(self, priority, known):
+        self.message = f"Unknown request priority {priority!r}, expected one of {', '.join(known)}"
+        super().__init__(self.message)
+
+
+class RequestExpired(Exception):
+    def __init__(self, priority):
+        self.message = f"Dropped {priority} request that passed its deadline"
+        super().__init__(self.message)
+
+
+class MissingDependency(Exception):
+    def __init__(self, package):
+        self.message = f"{package} is required for this feature. Install it with pip install {package}"
+        super().__init__(self.message)
+
+
+class RemoteError(Exception):
+    def __init__(self, error, message):
+        self.message = f"Daemon raised {error}: {message}"
+        super().__init__(self.message)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # The token comes from the environment, since command lines are visible to every local user
+    token = os.environ.get("SPACETRADERS_TOKEN")
+    if len(sys.argv) != 2 or not token:
+        sys.exit("usage: SPACETRADERS_TOKEN=... SpaceTradersPy.py SOCKET_PATH")
+    with SpaceTraderDaemon(SpaceTrader(token=token), sys.argv[1]) as daemon:
+        daemon.serve_forever()
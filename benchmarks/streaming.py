@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SpaceTradersPy import _iter_json_array
+
+
+# Compares decoding a recorded list or scan payload whole (what r.json() does) against
+# streaming its items with _iter_json_array. Each mode runs in its own process so peak RSS
+# is not shared between them.
+#
+#   python benchmarks/streaming.py --generate 200000 payload.json
+#   python benchmarks/streaming.py payload.json --path data --rate 10
+#   python benchmarks/streaming.py payload.json --check
+
+
+def generate(filename, count):
+    waypoints = [
+        dict(
+            symbol=f"X1-DF55-{i:06d}X",
+            type="ASTEROID_FIELD",
+            systemSymbol="X1-DF55",
+            x=i % 800 - 400,
+            y=i // 800 - 400,
+            orbitals=[],
+            traits=[
+                dict(symbol="MINERAL_DEPOSITS", name="Mineral Deposits", description="Rich in ores " * 8),
+                dict(symbol="COMMON_METAL_DEPOSITS", name="Common Metal Deposits", description="Iron " * 8),
+            ],
+            chart=dict(submittedBy="COSMIC", submittedOn="2023-06-01T12:00:00.000Z"),
+        )
+        for i in range(count)
+    ]
+    with open(filename, "w") as f:
+        json.dump(dict(data=waypoints, meta=dict(total=count, page=1, limit=count)), f)
+
+
+def chunks(filename, chunk_size, rate):
+    # Paces reads to a given MB/s so time-to-first-item reflects bytes arriving over the network
+    with open(filename, "rb") as f:
+        started = time.perf_counter()
+        sent = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            sent += len(chunk)
+            if rate:
+                delay = sent / (rate * 1024 * 1024) - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield chunk
+
+
+# Chunk boundaries that once made the parser cut a number short
+SPLIT_CASES = [
+    ([b'{"data": [538.', b'25]}'], [538.25]),
+    ([b'{"data": [1e', b'5]}'], [1e5]),
+    ([b'{"n": 1.', b'5, "data": [1]}'], [1]),
+    ([b'{"data": [tr', b'ue, nu', b'll]}'], [True, None]),
+]
+
+
+def check(filename, path, splits=3000):
+    for chunked, expected in SPLIT_CASES:
+        got = list(_iter_json_array(chunked, ("data",)))
+        assert got == expected, (chunked, got)
+
+    # Random chunk boundaries over scalar-heavy documents must decode exactly like json.loads
+    rng = random.Random(0)
+    for _ in range(splits):
+        doc = dict(
+            n=rng.random() * 1000,
+            data=[rng.choice([rng.random() * 1e6, -rng.randint(0, 10 ** 9), 1.5e-7, True, None, "s", dict(a=1.25)])
+                  for _ in range(5)],
+            meta=dict(t=3.5),
+        )
+        raw = json.dumps(doc).encode()
+        cuts = sorted(rng.sample(range(1, len(raw)), 3))
+        chunked = [raw[a:b] for a, b in zip([0] + cuts, cuts + [len(raw)])]
+        got = list(_iter_json_array(chunked, ("data",)))
+        assert got == doc["data"], (chunked, got)
+
+    with open(filename, "rb") as f:
+        raw = f.read()
+    expected = json.loads(raw)
+    for key in path:
+        expected = expected[key]
+    for chunk_size in (1, 7, 4096):
+        got = list(_iter_json_array((raw[i:i + chunk_size] for i in range(0, len(raw), chunk_size)), path))
+        assert got == expected, chunk_size
+    print(f"check passed: {len(SPLIT_CASES)} split cases, {splits} random splits, payload at 3 chunk sizes")
+
+
+def run(mode, filename, path, chunk_size, rate):
+    started = time.perf_counter()
+    first = None
+    count = 0
+
+    if mode == "full":
+        body = json.loads(b"".join(chunks(filename, chunk_size, rate)))
+        for key in path:
+            body = body[key]
+        for item in body:
+            if first is None:
+                first = time.perf_counter() - started
+            count += 1
+    else:
+        for item in _iter_json_array(chunks(filename, chunk_size, rate), path):
+            if first is None:
+                first = time.perf_counter() - started
+            count += 1
+
+    total = time.perf_counter() - started
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    print(json.dumps(dict(mode=mode, items=count, first_item=first, total=total, peak_rss_kib=peak)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("payload")
+    parser.add_argument("--generate", type=int, help="write a synthetic waypoint page with this many items and exit")
+    parser.add_argument("--path", default="data", help="dotted key path of the array, e.g. data.waypoints")
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    parser.add_argument("--rate", type=float, default=0, help="simulated download rate in MB/s, 0 for unthrottled")
+    parser.add_argument("--mode", choices=("full", "stream"))
+    parser.add_argument("--check", action="store_true", help="verify streamed items match json.loads and exit")
+    args = parser.parse_args()
+
+    # Generating inflates this process, and Linux children inherit its peak RSS, so stop here
+    if args.generate:
+        generate(args.payload, args.generate)
+        return
+    path = tuple(args.path.split("."))
+
+    if args.check:
+        check(args.payload, path)
+        return
+
+    if args.mode:
+        run(args.mode, args.payload, path, args.chunk_size, args.rate)
+        return
+
+    size = os.path.getsize(args.payload)
+    print(f"{args.payload}: {size / 1024 / 1024:.1f} MiB")
+    for mode in ("full", "stream"):
+        out = subprocess.run(
+            [sys.executable, __file__, args.payload, "--path", args.path, "--chunk-size", str(args.chunk_size),
+             "--rate", str(args.rate), "--mode", mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(out)
+        print(
+            f"{mode:>6}: {result['items']} items, first item {result['first_item'] * 1000:.1f} ms, "
+            f"total {result['total'] * 1000:.1f} ms, peak RSS {result['peak_rss_kib'] / 1024:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()